@@ -1,14 +1,44 @@
 import os
+import argparse
 import subprocess
 import zipfile
+import io
+import struct
 import time
 import csv
+import json
+import base64
 import hashlib
 import shutil
+import tempfile
 import re
 import random
 import unicodedata
-from collections import defaultdict
+import threading
+import functools
+import heapq
+import itertools
+import operator
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+try:
+    import xxhash   # Fast non-cryptographic hash for content dedup (pip install xxhash)
+except ImportError:
+    xxhash = None
+
+try:
+    import requests   # Persistent HTTPS session for the Kaggle REST API (installed with the kaggle CLI)
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+except ImportError:
+    requests = None
+
+try:
+    import pyarrow as pa         # Multithreaded C++ CSV reader for row counting (pip install pyarrow)
+    import pyarrow.csv as pacsv
+except ImportError:
+    pa = pacsv = None
 
 # ================== Basic Configuration ==================
 KAGGLE_API_TOKEN = ""
@@ -24,10 +54,16 @@ ALLOW_DOWNLOAD_IF_SIZE_UNKNOWN = True
 MIN_ROWS = 300
 MAX_ROWS = 50000
 MIN_COLS = 4
+MIN_CSV_BYTES = MIN_ROWS * MIN_COLS       # Heuristic size floor: MIN_ROWS rows of MIN_COLS fields take at least this many bytes,
+                                          # but blank lines also count as rows, so a few passing files are smaller
+MAX_CSV_BYTES = 500 * 1024 * 1024         # Skip larger entries: far beyond what MAX_ROWS rows normally take
 
 MAX_CSV_PER_DATASET = 5                   # Save at most 5 CSVs per dataset
 MAX_SCAN_CSV_ENTRIES_PER_DATASET = 200    # Scan at most N CSV entries per dataset (fast + sufficient)
 MAX_DATASET_TOTAL_MB = 2048               # Pre-check: only download datasets <= 2GB
+SIZE_CACHE_TTL = 7 * 24 * 3600            # Reuse a looked-up dataset size for 7 days
+SIZE_CACHE_FAIL_TTL = 3600                # Failed lookups (size unknown) are retried after 1 hour
+SIZE_CACHE_FLUSH_EVERY = 50               # Write size_cache.json after this many new lookups
 
 SEARCH_KEYWORDS = [
     "csv", "tabular", "dataset",
@@ -46,24 +82,83 @@ SEARCH_KEYWORDS = [
 
 PAGES_PER_KEYWORD = 50
 
-# Base sleep between datasets (plus random jitter to reduce rate-limiting risk)
-BASE_SLEEP = 0.6
-JITTER_SLEEP = (0.0, 0.6)  # Add random 0~0.6 seconds
+MAX_WORKERS = os.cpu_count() or 4   # CPU worker processes (unzip -> row/col filter)
+ENTRY_WORKERS = 4                   # Threads per worker process scanning entries of one ZIP (zlib/Arrow release the GIL)
+LIST_WORKERS = 4                    # Search pages listed concurrently (one page of lookahead per keyword)
+PROBE_WORKERS = 8                   # Datasets size-checked concurrently
+DOWNLOAD_WORKERS = 8                # Datasets downloaded concurrently
+KAGGLE_CONCURRENCY = 8              # Max in-flight short Kaggle calls (list/files); downloads have their own slots
+
+# Token bucket for Kaggle CLI calls (rate-limit mitigation): at most N calls per period, bursts up to N
+KAGGLE_RATE_LIMIT = (20, 10.0)      # 20 calls / 10 seconds
+
+USE_HTTP_API = True                 # Search/download over one keep-alive HTTPS session (CLI is the fallback)
+KAGGLE_API_BASE = "https://www.kaggle.com/api/v1"
 # =========================================================
 
 RAW_DIR = os.path.join(BASE_DIR, "raw_datasets")
 CSV_DIR = os.path.join(BASE_DIR, "all_csv")
 INDEX_PATH = os.path.join(BASE_DIR, "index.csv")
+SIZE_CACHE_PATH = os.path.join(BASE_DIR, "size_cache.json")   # dataset_ref -> [total MB, lookup time], kept across runs
+SEEN_REFS_PATH = os.path.join(BASE_DIR, "seen_refs.txt")       # Every dataset ref already evaluated
 
-os.makedirs(RAW_DIR, exist_ok=True)
+os.makedirs(os.path.join(RAW_DIR, "_meta"), exist_ok=True)
 os.makedirs(CSV_DIR, exist_ok=True)
 
-csv_hashes = set()            # Global dedup by content MD5
+csv_hashes = set()            # Global dedup by raw 16-byte content digest (xxh3_128, BLAKE2b-128 fallback)
+collected_count = 0           # CSVs in index.csv (resumed + saved this run): what TARGET_MAX counts
 downloaded_datasets = set()
-index_rows = []
+seen_refs = set()             # Refs evaluated (downloaded, skipped or failed): never probed twice
+retry_refs = set()            # Subset of seen_refs that failed transiently: skipped this run, retried next run
+size_name_dups = set()        # (uncompressed size, name_sig) already confirmed duplicate by content hash
+csv_fingerprints = set()      # (ZipInfo.CRC, size) of every entry whose content is already known
+
+INDEX_HEADER = ["filename", "rows", "cols", "size_kb", "md5", "source", "keyword",
+                "name_sig", "orig_zip_name", "fixed_zip_name", "crc32", "size_bytes", "digest"]
+# "md5" is the historical name of the content-hash column (bare hex, algorithm not recorded);
+# "digest" is "<HASH_ALGO>:<hex>" and is the only one load_index trusts for dedup
+INDEX_FLUSH_EVERY = 256       # Flush index.csv to disk every N rows
+_index_fp = None              # index.csv handle, held open for the whole run
+_index_writer = None
+_index_unflushed = 0
+
+
+# ------------------------------ Precompiled patterns for hot helpers ------------------------------
+_RE_WS = re.compile(r"\s+")
+_RE_US = re.compile(r"_+")
+_RE_SAFE = re.compile(r"[0-9a-zA-Z._\-]+(?: [0-9a-zA-Z._\-]+)*")   # Already sanitized (single spaces, no edges)
+
+
+class _SanitizeTable(dict):
+    """
+    str.translate table for sanitize_filename: Windows-invalid and control characters, and
+    anything outside [0-9a-zA-Z._- ] / CJK, map to '_'. Filled lazily and memoized per code
+    point, so one C-level translate replaces two regex passes.
+    """
+
+    def __missing__(self, cp):
+        c = chr(cp)
+        keep = (c.isascii() and (c.isalnum() or c in "._- ")) or "\u4e00" <= c <= "\u9fff"
+        self[cp] = v = cp if keep else 0x5F
+        return v
+
+
+_SANITIZE_TABLE = _SanitizeTable()
+_RE_TRAIL_PAREN_NUM = re.compile(r"[\s_\-]*\(\d+\)$")
+_RE_TRAIL_NUM = re.compile(r"[\s_\-]*\d+$")
+# One "<name> <size> KB|MB|GB" row of `kaggle datasets files` output, skipping header/separator rows
+# ([^\S\n] = whitespace except newline, so a match never spans rows)
+_RE_SIZE_LINE = re.compile(r"^(?![^\S\n]*(?:name|-))(.*?)(\d+(?:\.\d+)?)[^\S\n]*(KB|MB|GB)\b[^\S\n]*$",
+                           re.IGNORECASE | re.MULTILINE)
+_UNIT_MB = {"B": 1 / (1024 * 1024), "KB": 1 / 1024, "MB": 1.0, "GB": 1024.0, "TB": 1024.0 * 1024}
+# Human-readable "size" cell of `kaggle datasets list -v` (e.g. "21MB", "1.2 GB")
+_RE_HUMAN_SIZE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*(B|KB|MB|GB|TB)\s*$", re.IGNORECASE)
+# Header row of `kaggle datasets list -v` (CSV); CLI warnings may be printed above it
+_RE_LISTING_HEADER = re.compile(r"^ref,", re.MULTILINE)
 
 
 # ------------------------------ Filename encoding repair (new) ------------------------------
+@functools.lru_cache(maxsize=4096)
 def try_fix_zip_name(name: str) -> str:
     """
     Attempt to repair filenames inside ZIP archives (not guaranteed 100%).
@@ -74,26 +169,32 @@ def try_fix_zip_name(name: str) -> str:
         return name
     try:
         raw = name.encode("cp437", errors="replace")
-        candidates = []
+        # Fast path: first encoding that decodes strictly (rejects invalid sequences in C)
+        for enc in ("utf-8", "gbk", "big5"):
+            try:
+                decoded = raw.decode(enc)
+            except UnicodeDecodeError:
+                continue
+            if "�" not in decoded:
+                return decoded
+
+        # Partially damaged names: keep the decoding with the fewest replacement characters;
+        # only change if strictly better
+        best, best_score = name, name.count("�")
         for enc in ("utf-8", "gbk", "big5"):
             try:
-                fixed = raw.decode(enc, errors="replace")
-                candidates.append(fixed)
+                decoded = raw.decode(enc, errors="replace")
             except Exception:
-                pass
-        if not candidates:
-            return name
-        # Choose the one with the fewest replacement characters
-        candidates.sort(key=lambda s: s.count("�"))
-        best = candidates[0]
-        # If not actually better, don't change it
-        if best.count("�") >= name.count("�"):
-            return name
+                continue
+            score = decoded.count("�")
+            if score < best_score:
+                best, best_score = decoded, score
         return best
     except Exception:
         return name
 
 
+@functools.lru_cache(maxsize=8192)   # Pure; the same names (train.csv, ...) recur across datasets
 def sanitize_filename(name: str, max_len: int = 120) -> str:
     """
     Convert any string into a Windows-safe filename:
@@ -103,17 +204,19 @@ def sanitize_filename(name: str, max_len: int = 120) -> str:
       - Collapse extra spaces/underscores
       - Truncate to max_len
     """
-    name = unicodedata.normalize("NFKC", name)
+    # Fast path: plain ASCII names that every step below would leave unchanged
+    if len(name) <= max_len and "__" not in name and _RE_SAFE.fullmatch(name):
+        return name
 
-    # Remove Windows-invalid characters and control chars
-    name = re.sub(r'[<>:"/\\|?*\x00-\x1F]', "_", name)
+    name = unicodedata.normalize("NFKC", name)
 
-    # Keep only a safe character set; replace others with '_'
-    name = re.sub(r'[^0-9a-zA-Z._\- \u4e00-\u9fff]+', "_", name)
+    # Replace Windows-invalid / control chars and anything outside the safe set with '_'
+    # (runs become '__'..., collapsed below like the underscores already in the name)
+    name = name.translate(_SANITIZE_TABLE)
 
     # Collapse whitespace/underscores
-    name = re.sub(r"\s+", " ", name).strip()
-    name = re.sub(r"_+", "_", name)
+    name = _RE_WS.sub(" ", name).strip()
+    name = _RE_US.sub("_", name)
 
     # Truncate
     if len(name) > max_len:
@@ -123,79 +226,277 @@ def sanitize_filename(name: str, max_len: int = 120) -> str:
     return name or "file"
 
 
-def safe_output_name(orig_basename: str, md5_hex: str) -> str:
+def safe_output_name(orig_basename: str, md5) -> str:
     """
     Generate a safe filename using:
       original basename (may be garbled) + short md5 suffix
     to avoid collisions and encoding issues.
+    md5 may be the raw digest bytes or its hex form; the suffix is 10 base32 chars
+    (50 bits of the digest, vs 40 bits for 10 hex chars).
     """
     base, ext = os.path.splitext(orig_basename)
     ext = ext if ext else ".csv"
     safe_base = sanitize_filename(base)
-    suffix = md5_hex[:10]
+    digest = md5 if isinstance(md5, bytes) else bytes.fromhex(md5)
+    suffix = base64.b32encode(digest[:7]).decode("ascii").lower()[:10]
     return f"{safe_base}_{suffix}{ext}"
 
 
 # ------------------------------ Generic helper: run command with retry ------------------------------
+class RateLimiter:
+    """
+    Thread-safe token bucket: at most `rate` acquisitions per `period` seconds.
+    """
+
+    def __init__(self, rate: int, period: float):
+        self.rate = rate
+        self.period = period
+        self._tokens = float(rate)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.rate, self._tokens + (now - self._last) * self.rate / self.period)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = (1 - self._tokens) * self.period / self.rate
+            time.sleep(delay)
+
+
+_kaggle_limiter = RateLimiter(*KAGGLE_RATE_LIMIT)
+_kaggle_slots = threading.BoundedSemaphore(KAGGLE_CONCURRENCY)
+# Downloads hold a slot for the whole transfer: separate slots, so they never starve list/probe calls
+_download_slots = threading.BoundedSemaphore(DOWNLOAD_WORKERS)
+_THREAD_LOCAL = threading.local()
+JITTER_SCHEDULE_LEN = 4096
+
+
+def _jitter() -> float:
+    """
+    Next value in [0, 1) from this thread's precomputed jitter schedule.
+    Each thread seeds its own random.Random, so concurrent retries don't back off in lockstep.
+    """
+    it = getattr(_THREAD_LOCAL, "jitters", None)
+    if it is None:
+        rng = random.Random(os.getpid() ^ time.time_ns() ^ threading.get_ident())
+        it = _THREAD_LOCAL.jitters = itertools.cycle([rng.random() for _ in range(JITTER_SCHEDULE_LEN)])
+    return next(it)
+
+
 def run_with_retry(cmd, *, retries=3, base_delay=2.0, jitter=1.0, timeout=None,
-                   capture_output=False, stdout_to_null=False):
+                   capture_output=False, stdout_to_null=False, slots=_kaggle_slots):
     """
     For commands like kaggle list/files that may fail intermittently due to network issues.
+    Each attempt holds one of `slots` (_download_slots for downloads).
     """
     last = None
     for attempt in range(1, retries + 1):
         try:
-            if stdout_to_null:
-                result = subprocess.run(
-                    cmd,
-                    text=True,
-                    stdout=subprocess.DEVNULL,
-                    stderr=subprocess.PIPE,
-                    timeout=timeout
-                )
-            else:
-                result = subprocess.run(
-                    cmd,
-                    text=True,
-                    capture_output=capture_output,
-                    timeout=timeout
-                )
+            _kaggle_limiter.acquire()
+            with slots:
+                if stdout_to_null:
+                    result = subprocess.run(
+                        cmd,
+                        text=True,
+                        stdout=subprocess.DEVNULL,
+                        stderr=subprocess.PIPE,
+                        timeout=timeout
+                    )
+                else:
+                    result = subprocess.run(
+                        cmd,
+                        text=True,
+                        capture_output=capture_output,
+                        timeout=timeout
+                    )
 
             if result.returncode == 0:
                 return result
 
             last = result
             if attempt < retries:
-                delay = base_delay * attempt + random.random() * jitter
+                delay = base_delay * attempt + _jitter() * jitter
                 print(f"⚠️ Command failed, retrying in {delay:.1f}s ({attempt}/{retries}): {' '.join(cmd)}")
                 time.sleep(delay)
 
         except subprocess.TimeoutExpired as e:
             last = e
             if attempt < retries:
-                delay = base_delay * attempt + random.random() * jitter
+                delay = base_delay * attempt + _jitter() * jitter
                 print(f"⚠️ Command timed out, retrying in {delay:.1f}s ({attempt}/{retries}): {' '.join(cmd)}")
                 time.sleep(delay)
 
     return last
 
 
+# ------------------------------ Kaggle REST API (keep-alive HTTPS session) ------------------------------
+_http_session = None              # requests.Session, False once found unusable
+_http_session_lock = threading.Lock()
+
+
+def kaggle_http_auth():
+    """
+    Credentials for the REST API, same sources as the CLI: KAGGLE_API_TOKEN (bearer),
+    else KAGGLE_USERNAME/KAGGLE_KEY, else kaggle.json. Returns (headers, basic_auth) or None.
+    """
+    token = os.environ.get("KAGGLE_API_TOKEN")
+    if token:
+        return {"Authorization": f"Bearer {token}"}, None
+
+    user, key = os.environ.get("KAGGLE_USERNAME"), os.environ.get("KAGGLE_KEY")
+    if not (user and key):
+        config_dir = os.environ.get("KAGGLE_CONFIG_DIR") or os.path.join(os.path.expanduser("~"), ".kaggle")
+        try:
+            with open(os.path.join(config_dir, "kaggle.json"), "r", encoding="utf-8") as f:
+                cfg = json.load(f)
+            user, key = cfg.get("username"), cfg.get("key")
+        except (OSError, ValueError):
+            pass
+    if user and key:
+        return {}, (user, key)
+    return None
+
+
+def kaggle_http_session():
+    """
+    Shared session (thread-safe for GETs): pooled keep-alive connections reuse TCP/TLS across
+    calls instead of spawning a CLI process per call. None when disabled or unavailable.
+    """
+    global _http_session
+    if not USE_HTTP_API or requests is None:
+        return None
+    with _http_session_lock:
+        if _http_session is None:
+            auth = kaggle_http_auth()
+            if auth is None:
+                _http_session = False
+            else:
+                session = requests.Session()
+                session.headers.update(auth[0])
+                session.auth = auth[1]
+                retry = Retry(total=3, backoff_factor=2.0, status_forcelist=(429, 500, 502, 503, 504),
+                              allowed_methods=frozenset(["GET"]))
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=LIST_WORKERS + DOWNLOAD_WORKERS,
+                                      max_retries=retry)
+                session.mount("https://", adapter)
+                _http_session = session
+    return _http_session or None
+
+
+def http_list_datasets(session, keyword: str, page: int):
+    # Same page as `kaggle datasets list -s keyword -p page`, as row dicts (ref, title, totalBytes, ...)
+    try:
+        _kaggle_limiter.acquire()
+        with _kaggle_slots:
+            r = session.get(f"{KAGGLE_API_BASE}/datasets/list",
+                            params={"search": keyword, "page": page}, timeout=90)
+        if r.status_code != 200:
+            return None
+        data = r.json()
+    except (requests.RequestException, ValueError):
+        return None
+    if not isinstance(data, list):
+        return None
+    return [row for row in data if isinstance(row, dict)]
+
+
+def http_dataset_files(session, dataset_ref: str):
+    # Same listing as `kaggle datasets files -d ref`, as [{"name", "size_mb"}] (all pages), or None
+    files, token = [], None
+    try:
+        while True:
+            _kaggle_limiter.acquire()
+            with _kaggle_slots:
+                r = session.get(f"{KAGGLE_API_BASE}/datasets/list/{dataset_ref}",
+                                params={"pageToken": token} if token else None, timeout=90)
+            if r.status_code != 200:
+                return None
+            data = r.json()
+            if not isinstance(data, dict) or data.get("errorMessage"):
+                return None
+            files.extend({"name": f.get("name", ""), "size_mb": float(f.get("totalBytes") or 0) / (1024 * 1024)}
+                         for f in data.get("datasetFiles") or () if isinstance(f, dict))
+            token = data.get("nextPageToken")
+            if not token:
+                return files
+    except (requests.RequestException, ValueError, TypeError):
+        return None
+
+
+def http_download(session, dataset_ref: str, dest_dir: str) -> bool:
+    """
+    Stream the dataset ZIP into dest_dir (1 MiB chunks, never held in memory).
+    Written as .part and renamed only once it is a complete ZIP, so newest_zip_entry
+    never sees a partial file.
+    """
+    part = os.path.join(dest_dir, dataset_ref.split("/")[-1] + ".zip.part")
+    try:
+        _kaggle_limiter.acquire()
+        with _download_slots, session.get(f"{KAGGLE_API_BASE}/datasets/download/{dataset_ref}",
+                                          stream=True, timeout=(30, 300)) as r:
+            if r.status_code != 200:
+                return False
+            with open(part, "wb") as f:
+                for chunk in r.iter_content(IO_CHUNK):
+                    f.write(chunk)
+        if not zipfile.is_zipfile(part):
+            os.remove(part)
+            return False
+        os.replace(part, part[:-len(".part")])
+        return True
+    except (requests.RequestException, OSError):
+        try:
+            os.remove(part)
+        except:
+            pass
+        return False
+
+
 # ------------------------------ Kaggle CLI wrappers ------------------------------
-def kaggle_download(dataset_ref: str) -> bool:
-    cmd = ["kaggle", "datasets", "download", "-d", dataset_ref, "-p", RAW_DIR]
+def kaggle_download(dataset_ref: str, dest_dir: str) -> bool:
+    session = kaggle_http_session()
+    if session is not None and http_download(session, dataset_ref, dest_dir):
+        return True
+
+    cmd = ["kaggle", "datasets", "download", "-d", dataset_ref, "-p", dest_dir]
     # Do not capture stdout (Kaggle progress output on Windows can hang subprocess)
     res = run_with_retry(cmd, retries=2, base_delay=3.0, jitter=2.0, timeout=None,
-                         capture_output=False, stdout_to_null=True)
+                         capture_output=False, stdout_to_null=True, slots=_download_slots)
     return hasattr(res, "returncode") and res.returncode == 0
 
 
 def kaggle_list_datasets(keyword: str, page: int):
+    """
+    One search results page as row dicts (at least "ref"), or None on failure.
+    """
+    session = kaggle_http_session()
+    if session is not None:
+        rows = http_list_datasets(session, keyword, page)
+        if rows is not None:
+            return rows
+
     cmd = ["kaggle", "datasets", "list", "-s", keyword, "-p", str(page), "-v"]
     res = run_with_retry(cmd, retries=3, base_delay=2.0, jitter=1.5, timeout=90,
                          capture_output=True, stdout_to_null=False)
     if not hasattr(res, "returncode") or res.returncode != 0:
         return None
-    return res.stdout
+    return parse_listing_csv(res.stdout)
+
+
+def parse_listing_csv(out: str):
+    """
+    Parse `kaggle datasets list -v` output into row dicts (ref, title, size, ...) in one csv pass.
+    Quoted titles with commas / newlines are handled; anything above the header row is skipped.
+    """
+    m = _RE_LISTING_HEADER.search(out)
+    if m is None:
+        return []
+    return list(csv.DictReader(io.StringIO(out[m.start():])))
 
 
 def kaggle_dataset_files(dataset_ref: str):
@@ -212,117 +513,428 @@ def kaggle_dataset_files(dataset_ref: str):
     return res.stdout
 
 
-def dataset_total_size_mb_via_metadata(dataset_ref: str) -> float:
-    meta_dir = os.path.join(RAW_DIR, "_meta")
-    os.makedirs(meta_dir, exist_ok=True)
+def parse_dataset_listing(out: str):
+    """
+    Parse `kaggle datasets files` output into [{"name", "size_mb"}] (header/separator rows skipped).
+    """
+    return [{"name": name.strip(), "size_mb": float(num) * _UNIT_MB[unit.upper()]}
+            for name, num, unit in _RE_SIZE_LINE.findall(out)]
+
 
-    # Remove stale metadata json files to avoid reading the wrong one
-    for f in os.listdir(meta_dir):
-        if f.endswith(".json"):
+def kaggle_dataset_files_listing(dataset_ref: str):
+    """
+    Parsed file listing of a dataset (REST first, CLI fallback), or None when both fail.
+    Not memoized: its only caller sits behind _size_cache, which already keeps every size per ref.
+    """
+    session = kaggle_http_session()
+    if session is not None:
+        files = http_dataset_files(session, dataset_ref)
+        if files is not None:
+            return files
+
+    out = kaggle_dataset_files(dataset_ref)
+    if out is None:
+        return None
+    return parse_dataset_listing(out)
+
+
+def dataset_total_size_mb_via_metadata(dataset_ref: str) -> float:
+    # Fresh folder per call: nothing stale to clean up first, removed again on exit
+    with tempfile.TemporaryDirectory(prefix="kgmeta_", dir=os.path.join(RAW_DIR, "_meta")) as meta_dir:
+        cmd = ["kaggle", "datasets", "metadata", "-d", dataset_ref, "-p", meta_dir]
+        res = run_with_retry(cmd, retries=3, base_delay=2.0, jitter=1.5, timeout=90,
+                             capture_output=True, stdout_to_null=False)
+        if not hasattr(res, "returncode") or res.returncode != 0:
             try:
-                os.remove(os.path.join(meta_dir, f))
+                print("❌ Kaggle 'metadata' failed:", dataset_ref)
+                print(res.stderr)
             except:
                 pass
+            return -1.0
 
-    cmd = ["kaggle", "datasets", "metadata", "-d", dataset_ref, "-p", meta_dir]
-    res = run_with_retry(cmd, retries=3, base_delay=2.0, jitter=1.5, timeout=90,
-                         capture_output=True, stdout_to_null=False)
-    if not hasattr(res, "returncode") or res.returncode != 0:
-        try:
-            print("❌ Kaggle 'metadata' failed:", dataset_ref)
-            print(res.stderr)
-        except:
-            pass
-        return -1.0
-
-    json_files = [x for x in os.listdir(meta_dir) if x.endswith(".json")]
-    if not json_files:
-        return -1.0
+        with os.scandir(meta_dir) as it:
+            meta_path = next((e.path for e in it if e.name.endswith(".json")), None)
+        if meta_path is None:
+            return -1.0
 
-    meta_path = os.path.join(meta_dir, json_files[0])
-    try:
-        import json
-        with open(meta_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        total_bytes = data.get("totalBytes", None)
-        if total_bytes is None:
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            total_bytes = data.get("totalBytes", None)
+            if total_bytes is None:
+                return -1.0
+            return float(total_bytes) / (1024 * 1024)
+        except Exception:
             return -1.0
-        return float(total_bytes) / (1024 * 1024)
-    except Exception:
-        return -1.0
 
 
 # ------------------------------ Pre-check: dataset total size ------------------------------
-def dataset_total_size_mb(dataset_ref: str) -> float:
-    mb = dataset_total_size_mb_via_metadata(dataset_ref)
-    if mb >= 0:
-        return mb
+_size_cache = {}                  # dataset_ref -> (total MB or inf, lookup time)
+_size_cache_lock = threading.Lock()
+_size_cache_dirty = 0             # Lookups since the last save
 
-    out = kaggle_dataset_files(dataset_ref)
-    if out is None:
-        return float("inf")
 
-    total_mb = 0.0
-    found = 0
-    for line in out.splitlines():
-        line = line.strip()
-        if not line:
-            continue
-        if line.lower().startswith("name") or line.startswith("-"):
-            continue
+def _size_cache_fresh(mb: float, ts: float, now: float) -> bool:
+    ttl = SIZE_CACHE_FAIL_TTL if mb == float("inf") else SIZE_CACHE_TTL
+    return now - ts < ttl
 
-        m = re.search(r"(\d+(?:\.\d+)?)\s*(KB|MB|GB)\b\s*$", line, re.IGNORECASE)
-        if not m:
+
+def load_size_cache():
+    try:
+        with open(SIZE_CACHE_PATH, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return
+    now = time.time()
+    entries = {}
+    for ref, v in data.items():
+        try:
+            mb, ts = float(v[0]), float(v[1])
+        except (TypeError, ValueError, IndexError):
             continue
+        if _size_cache_fresh(mb, ts, now):
+            entries[ref] = (mb, ts)
+    with _size_cache_lock:
+        _size_cache.update(entries)
+
+
+def save_size_cache():
+    global _size_cache_dirty
+    tmp = SIZE_CACHE_PATH + ".tmp"
+    # Held while writing so periodic saves from probe threads never interleave on the tmp file
+    with _size_cache_lock:
+        _size_cache_dirty = 0
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(_size_cache, f)   # inf is written as Infinity, which json.load accepts
+            os.replace(tmp, SIZE_CACHE_PATH)
+        except OSError as e:
+            print("⚠️ Failed to save size cache:", e)
+
+
+def listing_size_mb(row):
+    """
+    Dataset size in MB straight from a search results row, or None if it has none:
+    REST rows carry totalBytes, CLI rows (depending on the CLI version) totalBytes or "size".
+    """
+    total_bytes = row.get("totalBytes")
+    if total_bytes not in (None, ""):
+        try:
+            return float(total_bytes) / (1024 * 1024)
+        except (TypeError, ValueError):
+            pass
+    m = _RE_HUMAN_SIZE.match(str(row.get("size") or ""))
+    if m:
+        return float(m.group(1)) * _UNIT_MB[m.group(2).upper()]
+    return None
+
 
-        num = float(m.group(1))
-        unit = m.group(2).upper()
-        found += 1
+def remember_size(dataset_ref: str, mb: float):
+    # Size already known from the listing: the probe then answers from _size_cache, no extra call
+    global _size_cache_dirty
+    with _size_cache_lock:
+        _size_cache[dataset_ref] = (mb, time.time())
+        _size_cache_dirty += 1
 
-        if unit == "KB":
-            total_mb += num / 1024
-        elif unit == "MB":
-            total_mb += num
-        elif unit == "GB":
-            total_mb += num * 1024
 
-    if found == 0:
+def dataset_total_size_mb(dataset_ref: str) -> float:
+    """
+    Total dataset size in MB, or inf when it can't be determined.
+    Results within their TTL come from _size_cache (this run + SIZE_CACHE_PATH) without any
+    Kaggle call: sizes for SIZE_CACHE_TTL, failures only for SIZE_CACHE_FAIL_TTL so transient
+    errors are retried soon. The cache is flushed every SIZE_CACHE_FLUSH_EVERY lookups.
+    """
+    global _size_cache_dirty
+    now = time.time()
+    with _size_cache_lock:
+        hit = _size_cache.get(dataset_ref)
+    if hit is not None and _size_cache_fresh(*hit, now):
+        return hit[0]
+
+    mb = _dataset_total_size_mb(dataset_ref)
+    with _size_cache_lock:
+        _size_cache[dataset_ref] = (mb, now)
+        _size_cache_dirty += 1
+        flush = _size_cache_dirty >= SIZE_CACHE_FLUSH_EVERY
+    if flush:
+        save_size_cache()
+    return mb
+
+
+def _dataset_total_size_mb(dataset_ref: str) -> float:
+    # With the REST session the file listing is one in-process request; the CLI metadata call
+    # (a subprocess) is only tried first when everything goes through the CLI anyway
+    if kaggle_http_session() is None:
+        mb = dataset_total_size_mb_via_metadata(dataset_ref)
+        if mb >= 0:
+            return mb
+
+    listing = kaggle_dataset_files_listing(dataset_ref)
+    if not listing:
         return float("inf")
-    return total_mb
+    return sum(f["size_mb"] for f in listing)
 
 
 # ------------------------------ CSV handling: rows/cols/dedup/index ------------------------------
-def file_hash(path: str) -> str:
-    h = hashlib.md5()
-    with open(path, "rb") as f:
-        for chunk in iter(lambda: f.read(8192), b""):
-            h.update(chunk)
-    return h.hexdigest()
-
-
-def file_size_kb(path: str) -> float:
-    return round(os.path.getsize(path) / 1024, 2)
-
-
-def count_rows_cols(path: str):
-    with open(path, "r", encoding="utf-8", errors="ignore", newline="") as f:
-        r = csv.reader(f)
-        header = next(r, [])
-        cols = len(header)
-        rows = 0
-        for _ in r:
-            rows += 1
+IO_CHUNK = 1 << 20   # 1 MiB reads amortize Python call overhead
+SENDFILE_CHUNK = 16 << 20  # Bytes per os.sendfile call
+TEE_MAX_BYTES = 8 << 20    # Compressed entries up to this size are kept in memory while scanned (no second inflate)
+
+
+# Fallback when xxhash is missing: BLAKE2b-128 is faster than MD5 in CPython and the same digest size
+_blake2b_128 = functools.partial(hashlib.blake2b, digest_size=16)
+
+
+HASH_ALGO = "xxh3_128" if xxhash is not None else "blake2b_128"   # Recorded with every digest in index.csv
+
+
+def new_hasher():
+    return xxhash.xxh3_128() if xxhash is not None else _blake2b_128()
+
+
+def fast_copy(src: str, dst: str, offset: int = 0, count: int = None):
+    """
+    Copy `count` bytes of `src` starting at `offset` into a new file `dst` (whole file by default).
+    POSIX: in-kernel os.sendfile with a sequential-readahead hint; elsewhere (or if the
+    platform's sendfile refuses file targets) a 1 MiB buffered copy.
+    """
+    if count is None:
+        count = os.path.getsize(src) - offset
+
+    if hasattr(os, "sendfile"):
+        src_fd = os.open(src, os.O_RDONLY)
+        try:
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(src_fd, offset, count, os.POSIX_FADV_SEQUENTIAL)
+            dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                sent = 0
+                while sent < count:
+                    n = os.sendfile(dst_fd, src_fd, offset + sent, min(SENDFILE_CHUNK, count - sent))
+                    if n == 0:
+                        break
+                    sent += n
+                return
+            except OSError:
+                pass   # e.g. macOS only sends to sockets
+            finally:
+                os.close(dst_fd)
+        finally:
+            os.close(src_fd)
+
+    with open(src, "rb") as fi, open(dst, "wb") as fo:
+        fi.seek(offset)
+        remaining = count
+        while remaining > 0:
+            buf = fi.read(min(IO_CHUNK, remaining))
+            if not buf:
+                break
+            fo.write(buf)
+            remaining -= len(buf)
+
+
+def zip_stored_data_offset(zip_path: str, info):
+    """
+    Archive offset of an uncompressed, unencrypted entry's bytes (just past its local header),
+    or None if the entry must go through zipfile.
+    """
+    if info.compress_type != zipfile.ZIP_STORED or info.flag_bits & 0x1:
+        return None
+    with open(zip_path, "rb") as f:
+        f.seek(info.header_offset)
+        header = f.read(30)
+    if len(header) != 30 or header[:4] != b"PK\x03\x04":
+        return None
+    name_len, extra_len = struct.unpack("<HH", header[26:30])
+    return info.header_offset + 30 + name_len + extra_len
+
+
+def file_size_kb_entry(entry) -> float:
+    # Size in KB of an os.DirEntry / zipfile.ZipInfo: reuse the size already at hand, no extra stat
+    size = entry.file_size if isinstance(entry, zipfile.ZipInfo) else entry.stat().st_size
+    return round(size / 1024, 2)
+
+
+def _count_rows_cols_csv(src, row_limit=None):
+    # Full csv parse of a binary stream (honors quoted newlines)
+    f = io.TextIOWrapper(src, encoding="utf-8", errors="ignore", newline="")
+    r = csv.reader(f)
+    header = next(r, [])
+    cols = len(header)
+    rows = 0
+    for _ in r:
+        rows += 1
+        if row_limit is not None and rows > row_limit:
+            break
     return rows, cols
 
 
-def safe_unique_name(desired_name: str) -> str:
-    p = os.path.join(CSV_DIR, desired_name)
-    if not os.path.exists(p):
-        return desired_name
-    base, ext = os.path.splitext(desired_name)
-    return f"{base}_{time.time_ns()}{ext}"
+def _header_cols(header: bytes):
+    # Column count of a raw header line (read with readline(IO_CHUNK)), honoring quoting.
+    # None if a quoted cell spans lines, the line isn't "\n"-terminated (CR-only file, header
+    # over IO_CHUNK, or a header-only file) or csv rejects it: the caller then rescans with csv.
+    if not header:
+        return 0
+    if header.count(b'"') % 2 or not header.endswith(b"\n"):
+        return None
+    line = header.decode("utf-8", errors="ignore").rstrip("\r\n")
+    try:
+        return len(next(csv.reader([line]), []))
+    except csv.Error:
+        return None
+
+
+class _HashingReader(io.RawIOBase):
+    """
+    Raw stream wrapper that feeds every byte read from `src` to `hasher`,
+    so a C-level consumer (Arrow) can read while we hash in the same pass.
+    """
+
+    def __init__(self, src, hasher):
+        self.src = src
+        self.hasher = hasher
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        data = self.src.read(len(b))
+        n = len(data)
+        b[:n] = data
+        self.hasher.update(data)
+        return n
+
+
+class _TeeHasher:
+    """
+    Hasher proxy that also keeps every chunk it is fed (references, no copy), so an
+    accepted entry can be written out from the scan pass instead of re-inflating it.
+    """
 
+    def __init__(self, hasher):
+        self.hasher = hasher
+        self.chunks = []
 
+    def update(self, data):
+        self.hasher.update(data)
+        self.chunks.append(data)
+
+    def digest(self):
+        return self.hasher.digest()
+
+
+def count_rows_cols_arrow(src, hasher=None, row_limit=None):
+    """
+    Rows/cols of a binary CSV stream with Arrow's multithreaded reader (exact with quoted newlines).
+    Header is parsed in Python; Arrow only materializes the first column, as strings, so type
+    inference can't fail. Rows with a different field count are counted, not rejected, and so are
+    blank lines, matching the byte scanner and csv.reader (the row gate must not depend on pyarrow).
+    Returns (rows, cols) like scan_csv_stream; raises pyarrow.ArrowException on unparseable input.
+    Stops early once rows exceed row_limit (see scan_csv_stream).
+    """
+    if hasher is not None:
+        src = _HashingReader(src, hasher)
+    f = io.BufferedReader(src, IO_CHUNK)
+    cols = _header_cols(f.readline(IO_CHUNK))
+    if cols is None:
+        return 0, None
+
+    ragged = 0
+
+    def count_ragged(row):
+        nonlocal ragged
+        ragged += 1
+        return "skip"
+
+    reader = pacsv.open_csv(
+        f,
+        read_options=pacsv.ReadOptions(block_size=1 << 23, use_threads=True, autogenerate_column_names=True),
+        parse_options=pacsv.ParseOptions(newlines_in_values=True, ignore_empty_lines=False,
+                                         invalid_row_handler=count_ragged),
+        convert_options=pacsv.ConvertOptions(include_columns=["f0"], column_types={"f0": pa.string()}),
+    )
+    rows = 0
+    for batch in reader:
+        rows += batch.num_rows
+        if row_limit is not None and rows + ragged > row_limit:
+            break
+    return rows + ragged, cols
+
+
+def scan_csv_stream(src, hasher=None, row_limit=None):
+    """
+    Fast rows/cols count over a binary stream in one pass: header parsed with
+    csv (honors quoting), data rows counted as raw newlines in 1 MiB chunks.
+    Every byte read is also fed to `hasher` when given.
+    Caveat: quoted cells with embedded newlines are over-counted, which is
+    fine for the coarse MIN_ROWS/MAX_ROWS gate.
+    Returns (rows, cols); cols is None if the header can't be read as one "\n" line
+    (see _header_cols), in which case nothing past the header is read and the caller
+    must rescan (and rehash) the whole stream with _count_rows_cols_csv.
+    With row_limit, reading stops as soon as rows > row_limit: the entry is rejected
+    anyway, so rows is then only a lower bound and `hasher` has seen a prefix.
+    """
+    header = src.readline(IO_CHUNK)
+    if hasher is not None:
+        hasher.update(header)
+    cols = _header_cols(header)
+    if cols is None:
+        return 0, None
+
+    rows = 0
+    last = b"\n"
+    while chunk := src.read(IO_CHUNK):
+        if hasher is not None:
+            hasher.update(chunk)
+        rows += chunk.count(b"\n")
+        last = chunk[-1:]
+        if row_limit is not None and rows > row_limit:
+            return rows, cols
+    if last != b"\n":
+        rows += 1   # Final row without trailing newline
+    return rows, cols
+
+
+def scan_zip_entry(zf, info, keep=False):
+    """
+    Stream one ZIP entry: (rows, cols, raw digest bytes, data), hashing in the same pass as counting.
+    Uses Arrow when installed, the byte-level newline scanner otherwise or when Arrow
+    can't parse the file, and full csv parsing if the header spans lines.
+    With keep=True, data is the entry's content as a list of chunks, otherwise None.
+    Reading stops early once the entry has more than MAX_ROWS rows (digest/data then partial).
+    """
+    def hasher():
+        return _TeeHasher(new_hasher()) if keep else new_hasher()
+
+    def data(h):
+        return h.chunks if keep else None
+
+    if pacsv is not None:
+        h = hasher()
+        try:
+            with zf.open(info) as src:
+                rows, cols = count_rows_cols_arrow(src, h, MAX_ROWS)
+            if cols is not None:
+                return rows, cols, h.digest(), data(h)
+        except Exception:
+            pass   # Any Arrow / IO failure: rescan with the byte-level scanner below
+
+    h = hasher()
+    with zf.open(info) as src:
+        rows, cols = scan_csv_stream(src, h, MAX_ROWS)
+    if cols is None:
+        # Header spans lines: the csv pass hashes (and keeps) everything it reads itself,
+        # so an accepted entry never carries the byte scanner's partial digest
+        h = hasher()
+        with zf.open(info) as src:
+            rows, cols = _count_rows_cols_csv(io.BufferedReader(_HashingReader(src, h), IO_CHUNK), MAX_ROWS)
+    return rows, cols, h.digest(), data(h)
+
+
+_TMP_COUNTER = itertools.count()   # Per-process tmp file sequence (time_ns is coarse on Windows)
+
+
+@functools.lru_cache(maxsize=4096)
 def name_signature(filename: str) -> str:
     """
     "Table name" normalized from filename (sanitized first to avoid garbled instability).
@@ -330,103 +942,268 @@ def name_signature(filename: str) -> str:
     """
     base = sanitize_filename(os.path.basename(filename))
     stem = os.path.splitext(base)[0].strip().lower()
-    stem = re.sub(r"[\s_\-]*\(\d+\)$", "", stem)
-    stem = re.sub(r"[\s_\-]*\d+$", "", stem)
+    stem = _RE_TRAIL_PAREN_NUM.sub("", stem)
+    stem = _RE_TRAIL_NUM.sub("", stem)
     stem = " ".join(stem.split())
     return stem or stem
 
 
-def write_index():
-    if not index_rows:
+def load_index():
+    """
+    Resume support: seed collected_count / csv_hashes / downloaded_datasets / csv_fingerprints
+    from an existing index.csv, so a rerun skips content and datasets that are already collected (and, by CRC
+    and size, re-uploads of collected CSVs without inflating them).
+    Only digests tagged with this run's HASH_ALGO are comparable; others (bare "md5" values from
+    older versions, or another algorithm when xxhash availability changed) are not used for dedup,
+    but their rows still count toward TARGET_MAX.
+    """
+    global collected_count
+    if not os.path.exists(INDEX_PATH):
+        return
+    foreign = 0
+    with open(INDEX_PATH, "r", newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            collected_count += 1
+            algo, _, digest = (row.get("digest") or "").rpartition(":")
+            if algo == HASH_ALGO:
+                try:
+                    csv_hashes.add(bytes.fromhex(digest))
+                except ValueError:
+                    foreign += 1
+            elif digest or row.get("md5"):
+                foreign += 1
+            if row.get("source"):
+                downloaded_datasets.add(row["source"])
+            if row.get("crc32") and row.get("size_bytes"):
+                try:
+                    csv_fingerprints.add((int(row["crc32"], 16), int(row["size_bytes"])))
+                except ValueError:
+                    pass
+    print(f"♻️ Resuming: {collected_count} CSVs from {len(downloaded_datasets)} datasets already indexed")
+    if foreign:
+        print(f"⚠️ {foreign} indexed CSVs have no {HASH_ALGO} digest: not used for content dedup "
+              f"(their datasets are still skipped)")
+
+
+def load_seen_refs():
+    if not os.path.exists(SEEN_REFS_PATH):
+        return
+    with open(SEEN_REFS_PATH, "r", encoding="utf-8") as f:
+        seen_refs.update(line.strip() for line in f if line.strip())
+
+
+def save_seen_refs():
+    tmp = SEEN_REFS_PATH + ".tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.writelines(ref + "\n" for ref in sorted(seen_refs - retry_refs))
+        os.replace(tmp, SEEN_REFS_PATH)
+    except OSError as e:
+        print("⚠️ Failed to save seen refs:", e)
+
+
+def _upgrade_index_header():
+    # index.csv from an older version (fewer columns): rewrite it once with INDEX_HEADER, new cells empty
+    try:
+        with open(INDEX_PATH, "r", newline="", encoding="utf-8") as f:
+            reader = csv.reader(f)
+            header = next(reader, None)
+            if header is None or header == INDEX_HEADER:
+                return
+            rows = [dict(zip(header, row)) for row in reader]
+    except FileNotFoundError:
         return
-    write_header = not os.path.exists(INDEX_PATH)
-    with open(INDEX_PATH, "a", newline="", encoding="utf-8") as f:
-        w = csv.writer(f)
-        if write_header:
-            # ✅ Added two columns: orig_zip_name / fixed_zip_name
-            w.writerow(["filename", "rows", "cols", "size_kb", "md5", "source", "keyword",
-                        "name_sig", "orig_zip_name", "fixed_zip_name"])
-        w.writerows(index_rows)
-    index_rows.clear()
-
-
-def newest_zip_in_dir(folder: str):
-    zips = [f for f in os.listdir(folder) if f.endswith(".zip")]
+    tmp = INDEX_PATH + ".tmp"
+    with open(tmp, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, INDEX_HEADER, restval="", extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(tmp, INDEX_PATH)
+
+
+def open_index():
+    global _index_fp, _index_writer
+    _upgrade_index_header()
+    _index_fp = open(INDEX_PATH, "a", newline="", encoding="utf-8", buffering=1 << 20)
+    _index_writer = csv.writer(_index_fp)
+    if _index_fp.tell() == 0:
+        _index_writer.writerow(INDEX_HEADER)
+
+
+def append_index_rows(rows):
+    # One writerows per dataset; buffered, flushed to disk every INDEX_FLUSH_EVERY rows
+    global _index_unflushed
+    if not rows:
+        return
+    _index_writer.writerows(rows)
+    _index_unflushed += len(rows)
+    if _index_unflushed >= INDEX_FLUSH_EVERY:
+        _index_fp.flush()
+        _index_unflushed = 0
+
+
+def close_index():
+    global _index_fp, _index_writer, _index_unflushed
+    if _index_fp is not None:
+        _index_fp.close()
+    _index_fp = _index_writer = None
+    _index_unflushed = 0
+
+
+def newest_zip_entry(folder: str):
+    # os.DirEntry of the most recent ZIP; its cached stat() also serves the caller's size check
+    with os.scandir(folder) as it:
+        zips = [e for e in it if e.name.endswith(".zip") and e.is_file()]
     if not zips:
         return None
-    zips.sort(key=lambda x: os.path.getmtime(os.path.join(folder, x)), reverse=True)
-    return os.path.join(folder, zips[0])
+    return max(zips, key=lambda e: e.stat().st_mtime)
+
+
+def downloaded_zip(folder: str, dataset_ref: str):
+    """
+    (path, size in bytes) of the dataset ZIP in its work folder, or None.
+    Both transports save it as <slug>.zip, so one stat usually answers; the directory
+    is only scanned if Kaggle chose another name.
+    """
+    path = os.path.join(folder, dataset_ref.split("/")[-1] + ".zip")
+    try:
+        return path, os.stat(path).st_size
+    except OSError:
+        pass
+    entry = newest_zip_entry(folder)
+    return (entry.path, entry.stat().st_size) if entry is not None else None
 
 
-def clear_raw_zips():
+def clear_raw_zips(folder: str):
     # Remove leftover ZIPs before downloading a new dataset to avoid picking an old ZIP by mistake
-    for f in os.listdir(RAW_DIR):
-        if f.endswith(".zip"):
-            try:
-                os.remove(os.path.join(RAW_DIR, f))
-            except:
-                pass
+    with os.scandir(folder) as it:
+        for e in it:
+            if e.name.endswith(".zip"):
+                try:
+                    os.remove(e.path)
+                except:
+                    pass
 
 
-def extract_and_filter(zip_path, dataset_ref, keyword):
-    """
-    Select CSVs from the dataset ZIP:
-      - Filter by rows/cols
-      - Global MD5 dedup
-      - Max 5 CSVs per dataset
-      - Prefer table-name diversity (different name_sig)
-      - Handle garbled filenames: save with safe filename + store original/fixed names in index
-    """
-    if len(csv_hashes) >= TARGET_MAX:
-        return 0
+def dataset_work_dir(dataset_ref: str) -> str:
+    # Private download folder per dataset so parallel workers never see each other's ZIPs
+    return os.path.join(RAW_DIR, dataset_ref.replace("/", "__"))
 
-    scanned = 0
-    candidates_by_name = defaultdict(list)
-    all_candidates = []
 
-    def add_candidate(tmp_path, orig_zip_name, fixed_zip_name, rows, cols, md5, sig):
-        if len(candidates_by_name[sig]) >= 20:
-            try:
-                os.remove(tmp_path)
-            except:
-                pass
-            return
-
-        cand = {
-            "tmp_path": tmp_path,
-            "orig_zip_name": orig_zip_name,
-            "fixed_zip_name": fixed_zip_name,
-            "basename": os.path.basename(fixed_zip_name),
-            "rows": rows,
-            "cols": cols,
-            "md5": md5,
-            "sig": sig
-        }
-        candidates_by_name[sig].append(cand)
-        all_candidates.append(cand)
+def entry_key(info):
+    # Cheap pre-dedup key from the central directory alone: (uncompressed size, table name)
+    return info.file_size, name_signature(os.path.basename(try_fix_zip_name(info.filename)))
 
-    try:
-        with zipfile.ZipFile(zip_path, "r") as zf:
-            for orig_zip_name in zf.namelist():
-                if len(csv_hashes) >= TARGET_MAX:
-                    break
-                if scanned >= MAX_SCAN_CSV_ENTRIES_PER_DATASET:
-                    break
-                if not orig_zip_name.lower().endswith(".csv"):
-                    continue
 
-                scanned += 1
+# Compression methods zipfile can inflate; anything else (e.g. Deflate64 = 9, common in ZIPs made by
+# Windows Explorer for large files) raises NotImplementedError only once the entry is opened
+_ZIP_READABLE = frozenset([zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED, zipfile.ZIP_BZIP2, zipfile.ZIP_LZMA])
 
+
+def _scan_entry(zf, info):
+    # Stored entries are cheap to copy again (sendfile), so only keep inflated bytes
+    keep = info.compress_type != zipfile.ZIP_STORED and info.file_size <= TEE_MAX_BYTES
+    return scan_zip_entry(zf, info, keep)
+
+
+def scan_entries_ahead(zf, entries, pool, depth):
+    """
+    Yield (info, future) in `entries` order while up to `depth` entries are scanned
+    on `pool` in the background. ZipFile serializes the raw reads internally, so
+    threads can share `zf`; inflating/hashing/counting run in parallel.
+    Futures not consumed (consumer broke out) are cancelled.
+    """
+    it = iter(entries)
+    ahead = deque((info, pool.submit(_scan_entry, zf, info)) for info in itertools.islice(it, depth))
+    try:
+        while ahead:
+            info, fut = ahead.popleft()
+            nxt = next(it, None)
+            if nxt is not None:
+                ahead.append((nxt, pool.submit(_scan_entry, zf, nxt)))
+            yield info, fut
+    finally:
+        for _, fut in ahead:
+            fut.cancel()
+
+
+def extract_and_filter(zip_path, skip_keys=frozenset(), known_fingerprints=frozenset()):
+    """
+    Stage candidate CSVs from the dataset ZIP (runs inside worker processes):
+      - Pre-filter entries by ZipInfo.file_size (MIN_CSV_BYTES..MAX_CSV_BYTES, no decompression)
+        and compression method (unsupported ones such as Deflate64 are dropped unopened),
+        then scan the smallest first so cheap files fill the quota before big ones are touched
+      - Stream each entry once: content hash + rows/cols in the same pass, nothing written yet
+        (small compressed entries are kept in memory meanwhile, so accepting them costs no re-inflate);
+        ENTRY_WORKERS threads scan ahead, results are consumed in order
+      - Filter by rows/cols; only passing entries are materialized into CSV_DIR
+      - Keep at most 20 candidates per table name (name_sig)
+      - Handle garbled filenames: keep original/fixed names for the index
+      - Skip entries whose (size, name_sig) is in `skip_keys`: the parent's snapshot of
+        size_name_dups, i.e. entries that are almost certainly re-uploads of a known CSV
+      - Skip entries whose (CRC32, size) from the central directory is in `known_fingerprints`
+        (content already collected or rejected as duplicate) or repeats within this ZIP;
+        the CRC is the uploader's checksum of the uncompressed bytes (verified by zipfile on read)
+    Global dedup and final selection happen in the parent (select_and_save),
+    because only the parent holds csv_hashes.
+    """
+    sig_count = {}   # name_sig -> candidates staged so far (only the count is needed here)
+    all_candidates = []
+    seen_md5 = set()
+
+    try:
+        with zipfile.ZipFile(zip_path, "r") as zf, ThreadPoolExecutor(max_workers=ENTRY_WORKERS) as pool:
+            entries = [
+                info for info in zf.infolist()
+                if not info.is_dir()
+                and info.filename.lower().endswith(".csv")
+                and MIN_CSV_BYTES <= info.file_size <= MAX_CSV_BYTES
+                and info.compress_type in _ZIP_READABLE
+            ]
+            if skip_keys:
+                entries = [info for info in entries if entry_key(info) not in skip_keys]
+            fingerprints = set(known_fingerprints)
+            unique = []
+            for info in entries:
+                fp = (info.CRC, info.file_size)
+                if fp not in fingerprints:
+                    fingerprints.add(fp)
+                    unique.append(info)
+            entries = sorted(unique, key=lambda info: info.file_size)
+
+            scans = scan_entries_ahead(zf, entries[:MAX_SCAN_CSV_ENTRIES_PER_DATASET], pool, ENTRY_WORKERS * 2)
+            for info, fut in scans:
+                orig_zip_name = info.filename
                 fixed_zip_name = try_fix_zip_name(orig_zip_name)
                 base = os.path.basename(fixed_zip_name)
                 if not base:
                     continue
 
-                tmp_path = os.path.join(CSV_DIR, f"_tmp_{time.time_ns()}.csv")
                 try:
-                    # Extract content using orig_zip_name (the real entry name)
-                    with zf.open(orig_zip_name) as src, open(tmp_path, "wb") as dst:
-                        dst.write(src.read())
+                    rows, cols, md5, data = fut.result()
+                except Exception:
+                    continue
+
+                if rows < MIN_ROWS or rows > MAX_ROWS or cols < MIN_COLS:
+                    continue
+
+                sig = name_signature(base)
+                if md5 in seen_md5 or sig_count.get(sig, 0) >= 20:
+                    continue
+
+                tmp_path = os.path.join(CSV_DIR, f"_tmp_{os.getpid()}_{next(_TMP_COUNTER)}.csv")
+                try:
+                    # Materialize only accepted entries; stored (uncompressed) entries are
+                    # copied in-kernel straight out of the archive (CRC already checked by the scan)
+                    offset = None if data is not None else zip_stored_data_offset(zip_path, info)
+                    if offset is not None:
+                        fast_copy(zip_path, tmp_path, offset, info.file_size)
+                    elif data is not None:
+                        with open(tmp_path, "wb") as dst:
+                            dst.writelines(data)
+                    else:
+                        with zf.open(info) as src, open(tmp_path, "wb") as dst:
+                            shutil.copyfileobj(src, dst, IO_CHUNK)
                 except Exception:
                     try:
                         os.remove(tmp_path)
@@ -434,196 +1211,402 @@ def extract_and_filter(zip_path, dataset_ref, keyword):
                         pass
                     continue
 
-                try:
-                    rows, cols = count_rows_cols(tmp_path)
-                except Exception:
-                    os.remove(tmp_path)
-                    continue
+                cand = {
+                    "tmp_path": tmp_path,
+                    "orig_zip_name": orig_zip_name,
+                    "fixed_zip_name": fixed_zip_name,
+                    "basename": base,
+                    "rows": rows,
+                    "cols": cols,
+                    "md5": md5,
+                    "size": info.file_size,
+                    "crc": info.CRC,
+                    "size_kb": file_size_kb_entry(info),
+                    "sig": sig
+                }
+                sig_count[sig] = sig_count.get(sig, 0) + 1
+                all_candidates.append(cand)
+                seen_md5.add(md5)
+
+                if len(sig_count) >= MAX_CSV_PER_DATASET and len(all_candidates) >= MAX_CSV_PER_DATASET * 2:
+                    break
+            scans.close()
 
-                if rows < MIN_ROWS or rows > MAX_ROWS or cols < MIN_COLS:
-                    os.remove(tmp_path)
-                    continue
+        return all_candidates
 
-                md5 = file_hash(tmp_path)
-                if md5 in csv_hashes:
-                    os.remove(tmp_path)
-                    continue
+    except Exception as e:
+        print("❌ Unzip/filter failed:", zip_path, e)
+        discard_candidates(all_candidates)
+        return []
 
-                sig = name_signature(base)
-                add_candidate(tmp_path, orig_zip_name, fixed_zip_name, rows, cols, md5, sig)
 
-                if len(candidates_by_name) >= MAX_CSV_PER_DATASET and len(all_candidates) >= MAX_CSV_PER_DATASET * 2:
-                    break
+def discard_candidates(candidates):
+    for cand in candidates:
+        try:
+            os.remove(cand["tmp_path"])
+        except:
+            pass
 
-        # Selection: prefer different table names
-        selected = []
-        selected_md5 = set()
 
-        sigs = list(candidates_by_name.keys())
-        sigs.sort(key=lambda s: len(candidates_by_name[s]), reverse=True)
+def select_and_save(candidates, dataset_ref, keyword):
+    """
+    Select CSVs among a dataset's staged candidates and save them (parent process only):
+      - Global content-hash dedup
+      - Max 5 CSVs per dataset
+      - Prefer table-name diversity (different name_sig)
+      - Save with safe filename + store original/fixed names in index
+    """
+    global collected_count
+    if collected_count >= TARGET_MAX:
+        discard_candidates(candidates)
+        return 0
 
-        for sig in sigs:
+    # Running best (most rows, first seen on ties) and count per name_sig: no list per sig
+    best_per_sig = {}
+    sig_count = {}
+    all_candidates = []
+    for cand in candidates:
+        if cand["md5"] in csv_hashes:
+            size_name_dups.add((cand["size"], cand["sig"]))
+            csv_fingerprints.add((cand["crc"], cand["size"]))
+            continue
+        sig = cand["sig"]
+        best = best_per_sig.get(sig)
+        if best is None or cand["rows"] > best["rows"]:
+            best_per_sig[sig] = cand
+        sig_count[sig] = sig_count.get(sig, 0) + 1
+        all_candidates.append(cand)
+
+    # Selection: prefer different table names (most frequent first), the largest table of each;
+    # heapq.nlargest keeps only the top MAX_CSV_PER_DATASET instead of sorting everything
+    # (same order as a stable descending sort, ties included)
+    by_rows = operator.itemgetter("rows")   # C-level key, no Python lambda frame per comparison
+    selected = []
+    selected_md5 = set()
+
+    for sig in heapq.nlargest(MAX_CSV_PER_DATASET, sig_count, key=sig_count.__getitem__):
+        cand = best_per_sig[sig]
+        if cand["md5"] in selected_md5:
+            continue
+        selected.append(cand)
+        selected_md5.add(cand["md5"])
+
+    if len(selected) < MAX_CSV_PER_DATASET:
+        # Top up by rows; at most len(selected) of the MAX_CSV_PER_DATASET largest are taken already
+        for cand in heapq.nlargest(MAX_CSV_PER_DATASET, all_candidates, key=by_rows):
             if len(selected) >= MAX_CSV_PER_DATASET:
                 break
-            cand = max(candidates_by_name[sig], key=lambda c: c["rows"])
             if cand["md5"] in selected_md5:
                 continue
             selected.append(cand)
             selected_md5.add(cand["md5"])
 
-        if len(selected) < MAX_CSV_PER_DATASET:
-            remaining = sorted(all_candidates, key=lambda c: c["rows"], reverse=True)
-            for cand in remaining:
-                if len(selected) >= MAX_CSV_PER_DATASET:
-                    break
-                if cand["md5"] in selected_md5:
-                    continue
-                selected.append(cand)
-                selected_md5.add(cand["md5"])
-
-        selected_tmp = set(c["tmp_path"] for c in selected)
+    selected_tmp = set(c["tmp_path"] for c in selected)
 
-        # Save with safe output filenames
-        added = 0
-        for cand in selected:
-            if len(csv_hashes) >= TARGET_MAX:
-                try:
-                    os.remove(cand["tmp_path"])
-                except:
-                    pass
-                continue
+    # Save with safe output filenames
+    new_rows = []
+    for cand in selected:
+        if collected_count >= TARGET_MAX:
+            discard_candidates([cand])
+            continue
 
-            safe_name = safe_output_name(cand["basename"], cand["md5"])
-            final_name = safe_unique_name(safe_name)
-            final_path = os.path.join(CSV_DIR, final_name)
+        safe_name = safe_output_name(cand["basename"], cand["md5"])
+        # The digest suffix already makes the name unique per content; an existing file of the
+        # same name (e.g. left by an interrupted run) holds the same bytes, so overwrite it
+        final_name = safe_name
+        final_path = os.path.join(CSV_DIR, final_name)
 
-            try:
-                os.rename(cand["tmp_path"], final_path)
-            except Exception:
-                try:
-                    os.remove(cand["tmp_path"])
-                except:
-                    pass
-                continue
+        try:
+            os.replace(cand["tmp_path"], final_path)
+        except Exception:
+            discard_candidates([cand])
+            continue
 
-            csv_hashes.add(cand["md5"])
-            index_rows.append([
-                final_name,
-                cand["rows"],
-                cand["cols"],
-                file_size_kb(final_path),
-                cand["md5"],
-                dataset_ref,
-                keyword,
-                cand["sig"],
-                cand["orig_zip_name"],
-                cand["fixed_zip_name"],
-            ])
-            added += 1
-
-        # Cleanup unselected temp files
-        for cand in all_candidates:
-            if cand["tmp_path"] not in selected_tmp:
-                try:
-                    os.remove(cand["tmp_path"])
-                except:
-                    pass
+        csv_hashes.add(cand["md5"])
+        csv_fingerprints.add((cand["crc"], cand["size"]))
+        collected_count += 1
+        new_rows.append([
+            final_name,
+            cand["rows"],
+            cand["cols"],
+            cand["size_kb"],
+            cand["md5"].hex(),
+            dataset_ref,
+            keyword,
+            cand["sig"],
+            cand["orig_zip_name"],
+            cand["fixed_zip_name"],
+            f"{cand['crc']:08x}",
+            cand["size"],
+            f"{HASH_ALGO}:{cand['md5'].hex()}",
+        ])
+    append_index_rows(new_rows)
+
+    # Cleanup unselected temp files
+    discard_candidates([c for c in candidates if c["tmp_path"] not in selected_tmp])
+    return len(new_rows)
+
+
+# ------------------------------ Pipeline stages ------------------------------
+def target_reached() -> bool:
+    # Read-only from worker threads (only the main thread grows collected_count)
+    return collected_count >= TARGET_MAX
+
+
+def probe_dataset(ref: str):
+    """
+    Stage 1 (probe thread): size pre-check of one dataset.
+    Returns the size in MB to download with (-1.0 if unknown but allowed), or None to skip.
+    """
+    if target_reached():
+        return None
+    print("📏 Checking size:", ref)
+    total_mb = dataset_total_size_mb(ref)
 
-        return added
+    if total_mb == float("inf"):
+        if ALLOW_DOWNLOAD_IF_SIZE_UNKNOWN:
+            print("⚠️ Size unknown: allowed to download; will apply 2GB check on ZIP after download.")
+            return -1.0
+        print("⏭️ Skip (unable to fetch file list/size)")
+        return None
 
-    except Exception as e:
-        print("❌ Unzip/filter failed:", zip_path, e)
-        for cand in all_candidates:
-            try:
-                os.remove(cand["tmp_path"])
-            except:
-                pass
-        return 0
+    if total_mb > MAX_DATASET_TOTAL_MB:
+        print(f"⏭️ Skip ({total_mb:.1f} MB > {MAX_DATASET_TOTAL_MB} MB)")
+        return None
+    return total_mb
 
 
-# ------------------------------ Main workflow ------------------------------
-def main():
-    print("===== Kaggle CSV Pipeline FINAL (retry / 2GB cap / ≤5 CSV per dataset) =====")
-    print("Output directory:", BASE_DIR)
-    print(f"Constraints: dataset<= {MAX_DATASET_TOTAL_MB}MB | rows {MIN_ROWS}-{MAX_ROWS} | cols>={MIN_COLS} | per-dataset<= {MAX_CSV_PER_DATASET}")
+def download_dataset(ref: str, total_mb: float):
+    """
+    Stage 2 (download thread): download one size-approved dataset into its own folder.
+    Returns (downloaded, zip_path); zip_path is None when there is nothing to scan.
+    """
+    if target_reached():
+        return False, None
 
-    for kw in SEARCH_KEYWORDS:
-        for page in range(1, PAGES_PER_KEYWORD + 1):
-            if len(csv_hashes) >= TARGET_MAX:
-                break
+    work_dir = dataset_work_dir(ref)
+    try:
+        os.mkdir(work_dir)   # Usual case: fresh folder, no leftover ZIPs to clear
+    except FileNotFoundError:
+        os.makedirs(work_dir, exist_ok=True)
+    except FileExistsError:
+        clear_raw_zips(work_dir)
 
-            print(f"\n🔍 Search [{kw}] page {page}")
-            out = kaggle_list_datasets(kw, page)
-            if out is None:
-                print("❌ Search failed (rate limit / network). Skipping this page.")
-                continue
+    zip_path = None
+    try:
+        print(f"⬇️ Download ({total_mb:.1f} MB):", ref)
+        if not kaggle_download(ref, work_dir):
+            print("⏭️ Download failed. Skipping.")
+            return False, None
 
-            lines = out.splitlines()
-            if len(lines) < 3:
-                continue
+        found = downloaded_zip(work_dir, ref)
+        if found is None:
+            print("⚠️ ZIP not found (download may have been rejected/failed).")
+            return True, None
 
-            for line in lines[2:]:
-                if len(csv_hashes) >= TARGET_MAX:
-                    break
+        zip_path, zip_bytes = found
+        zip_mb = zip_bytes / (1024 * 1024)
+        if zip_mb > MAX_DATASET_TOTAL_MB:
+            print(f"⏭️ ZIP too large, deleting and skipping ({zip_mb:.1f} MB > {MAX_DATASET_TOTAL_MB} MB)")
+            zip_path = None
+        return True, zip_path
 
-                line = line.strip()
-                if not line:
-                    continue
+    finally:
+        if zip_path is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
 
-                ref = line.split(",")[0].strip()
-                if "/" not in ref or ref in downloaded_datasets:
-                    continue
 
-                print("📏 Checking size:", ref)
-                total_mb = dataset_total_size_mb(ref)
+def process_zip(zip_path: str, skip_keys=frozenset(), known_fingerprints=frozenset()):
+    """
+    Stage 3 (worker process): stage candidate CSVs from a downloaded ZIP, then delete it.
+    """
+    try:
+        return extract_and_filter(zip_path, skip_keys, known_fingerprints)
+    finally:
+        shutil.rmtree(os.path.dirname(zip_path), ignore_errors=True)
 
-                if total_mb == float("inf"):
-                    if ALLOW_DOWNLOAD_IF_SIZE_UNKNOWN:
-                        print("⚠️ Size unknown: allowed to download; will apply 2GB check on ZIP after download.")
-                        total_mb = -1.0
-                    else:
-                        print("⏭️ Skip (unable to fetch file list/size)")
-                        continue
 
-                if total_mb > MAX_DATASET_TOTAL_MB:
-                    print(f"⏭️ Skip ({total_mb:.1f} MB > {MAX_DATASET_TOTAL_MB} MB)")
-                    continue
+# ------------------------------ Main workflow ------------------------------
+def iter_keyword_refs(keyword: str, list_pool, first_page):
+    """
+    Lazily yield (keyword, ref) over the search pages of one keyword. `first_page` is the
+    already-submitted listing of page 1; each next page is listed on `list_pool` while the
+    consumer drains the current one (one page of lookahead).
+    """
+    pending = first_page
+    try:
+        for page in range(1, PAGES_PER_KEYWORD + 1):
+            try:
+                rows = pending.result()
+            except Exception:
+                rows = None
+            pending = None
+            if page < PAGES_PER_KEYWORD:
+                pending = list_pool.submit(kaggle_list_datasets, keyword, page + 1)
 
-                clear_raw_zips()
+            print(f"\n🔍 Search [{keyword}] page {page}")
+            if rows is None:
+                print("❌ Search failed (rate limit / network). Skipping this page.")
+                continue
 
-                print(f"⬇️ Download ({total_mb:.1f} MB):", ref)
-                if not kaggle_download(ref):
-                    print("⏭️ Download failed. Skipping.")
+            for row in rows:
+                ref = (row.get("ref") or "").strip()
+                if "/" not in ref or ref in downloaded_datasets or ref in seen_refs:
                     continue
+                mb = listing_size_mb(row)
+                if mb is not None:
+                    remember_size(ref, mb)
+                yield keyword, ref
+    finally:
+        # Consumer stopped early (TARGET_MAX): drop the lookahead listing if not started
+        if pending is not None:
+            pending.cancel()
 
-                downloaded_datasets.add(ref)
 
-                zip_path = newest_zip_in_dir(RAW_DIR)
-                if not zip_path:
-                    print("⚠️ ZIP not found (download may have been rejected/failed).")
-                    continue
+def iter_candidate_refs(list_pool):
+    """
+    Round-robin over SEARCH_KEYWORDS (one ref per keyword in turn) so the collection
+    isn't dominated by the first topics. Page 1 of every keyword is listed concurrently
+    up front; stop iterating and no further pages are listed.
+    """
+    firsts = [list_pool.submit(kaggle_list_datasets, kw, 1) for kw in SEARCH_KEYWORDS]
+    streams = [iter_keyword_refs(kw, list_pool, f) for kw, f in zip(SEARCH_KEYWORDS, firsts)]
+    try:
+        yield from _round_robin(streams)
+    finally:
+        for stream in streams:
+            stream.close()
+        for f in firsts:
+            f.cancel()
 
-                zip_mb = os.path.getsize(zip_path) / (1024 * 1024)
-                if zip_mb > MAX_DATASET_TOTAL_MB:
-                    print(f"⏭️ ZIP too large, deleting and skipping ({zip_mb:.1f} MB > {MAX_DATASET_TOTAL_MB} MB)")
-                    try:
-                        os.remove(zip_path)
-                    except:
-                        pass
-                    continue
 
-                added = extract_and_filter(zip_path, ref, kw)
-                print(f"  ➜ Added CSVs: {added} | Total so far: {len(csv_hashes)}")
+def _round_robin(streams):
+    for batch in itertools.zip_longest(*streams):
+        for item in batch:
+            if item is not None:
+                yield item
 
-                try:
-                    os.remove(zip_path)
-                except:
-                    pass
 
-                write_index()
-                time.sleep(BASE_SLEEP + random.random() * (JITTER_SLEEP[1] - JITTER_SLEEP[0]))
+def merge_result(ref, keyword, candidates):
+    if collected_count >= TARGET_MAX:
+        seen_refs.discard(ref)   # Dropped only because the target was hit: re-evaluate next run
+    added = select_and_save(candidates, ref, keyword)
+    print(f"  ➜ [{ref}] Added CSVs: {added} | Total so far: {collected_count}")
+
 
-    write_index()
+def main(fresh: bool = False):
+    print("===== Kaggle CSV Pipeline FINAL (retry / 2GB cap / ≤5 CSV per dataset) =====")
+    print("Output directory:", BASE_DIR)
+    print(f"Constraints: dataset<= {MAX_DATASET_TOTAL_MB}MB | rows {MIN_ROWS}-{MAX_ROWS} | cols>={MIN_COLS} | per-dataset<= {MAX_CSV_PER_DATASET}")
+    print(f"Workers: {LIST_WORKERS} list / {PROBE_WORKERS} probe / {DOWNLOAD_WORKERS} download / {MAX_WORKERS} CPU | "
+          f"Kaggle <= {KAGGLE_CONCURRENCY} list/files + {DOWNLOAD_WORKERS} downloads in flight, "
+          f"{KAGGLE_RATE_LIMIT[0]} calls per {KAGGLE_RATE_LIMIT[1]:.0f}s")
+
+    if fresh:
+        # Start over: keep the previous index as a backup, forget evaluated refs (sizes stay cached)
+        if os.path.exists(INDEX_PATH):
+            os.replace(INDEX_PATH, INDEX_PATH + ".bak")
+            print("🆕 Fresh run: previous index moved to", INDEX_PATH + ".bak")
+    else:
+        load_index()
+        load_seen_refs()
+    load_size_cache()
+    open_index()
+    try:
+        probes = {}      # future -> (ref, keyword)
+        downloads = {}   # future -> (ref, keyword)
+        scans = {}       # future -> (ref, keyword)
+        stages = (probes, downloads, scans)
+
+        with ThreadPoolExecutor(max_workers=LIST_WORKERS) as list_pool, \
+                ThreadPoolExecutor(max_workers=PROBE_WORKERS) as probe_pool, \
+                ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as dl_pool, \
+                ProcessPoolExecutor(max_workers=MAX_WORKERS) as cpu_pool:
+
+            def pump(timeout=None):
+                # Each finished stage feeds the next; finished scans are merged here.
+                # Only this (main) thread touches collected_count / csv_hashes / downloaded_datasets / index.csv,
+                # so the shared state needs no locks.
+                pending = list(probes) + list(downloads) + list(scans)
+                if not pending:
+                    return
+                done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    if fut in probes:
+                        ref, kw = probes.pop(fut)
+                        if fut.cancelled():
+                            seen_refs.discard(ref)   # Never evaluated: leave it for the next run
+                            continue
+                        try:
+                            total_mb = fut.result()
+                        except Exception as e:
+                            print("❌ Size check stage failed:", ref, e)
+                            retry_refs.add(ref)
+                            continue
+                        if target_reached():
+                            seen_refs.discard(ref)
+                            continue
+                        if total_mb is not None:
+                            downloads[dl_pool.submit(download_dataset, ref, total_mb)] = (ref, kw)
+                    elif fut in downloads:
+                        ref, kw = downloads.pop(fut)
+                        if fut.cancelled():
+                            seen_refs.discard(ref)
+                            continue
+                        try:
+                            downloaded, zip_path = fut.result()
+                        except Exception as e:
+                            print("❌ Download stage failed:", ref, e)
+                            retry_refs.add(ref)
+                            continue
+                        if target_reached():
+                            seen_refs.discard(ref)
+                            if zip_path:
+                                shutil.rmtree(os.path.dirname(zip_path), ignore_errors=True)
+                            continue
+                        if downloaded:
+                            downloaded_datasets.add(ref)
+                        else:
+                            retry_refs.add(ref)   # Download failed (network / rate limit)
+                        if zip_path:
+                            scans[cpu_pool.submit(process_zip, zip_path, frozenset(size_name_dups),
+                                                  frozenset(csv_fingerprints))] = (ref, kw)
+                    else:
+                        ref, kw = scans.pop(fut)
+                        try:
+                            candidates = fut.result()
+                        except Exception as e:
+                            print("❌ Unzip/filter stage failed:", ref, e)
+                            retry_refs.add(ref)
+                            continue
+                        merge_result(ref, kw, candidates)
+
+            refs = iter_candidate_refs(list_pool)
+            for kw, ref in refs:
+                if collected_count >= TARGET_MAX:
+                    break
+                # Same ref under several keywords/pages: probe it once
+                if ref in seen_refs:
+                    continue
+                seen_refs.add(ref)
+
+                probes[probe_pool.submit(probe_dataset, ref)] = (ref, kw)
+
+                # Keep a bounded window in flight so TARGET_MAX stops work early
+                pump(timeout=0)
+                while sum(map(len, stages)) >= PROBE_WORKERS + DOWNLOAD_WORKERS + MAX_WORKERS:
+                    pump()
+            refs.close()
+
+            if collected_count >= TARGET_MAX:
+                for fut in list(probes) + list(downloads):
+                    fut.cancel()
+            while any(stages):
+                pump()
+    finally:
+        close_index()
+        save_size_cache()
+        save_seen_refs()
 
     if os.path.exists(RAW_DIR):
         try:
@@ -633,10 +1616,13 @@ def main():
             print("\n⚠️ Failed to remove raw_datasets:", e)
 
     print("\n===== Pipeline completed =====")
-    print("Final CSV count:", len(csv_hashes))
+    print("Final CSV count:", collected_count)
     print("CSV directory:", CSV_DIR)
     print("Index file:", INDEX_PATH)
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Collect tabular CSVs from Kaggle datasets")
+    parser.add_argument("--fresh", action="store_true",
+                        help="ignore index.csv / seen_refs.txt from earlier runs instead of resuming")
+    main(fresh=parser.parse_args().fresh)